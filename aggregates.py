@@ -0,0 +1,147 @@
+"""
+Per-day aggregates for the Twilitter Dash App
+
+Built once at ingest and shared by the time series and the comparison of
+two time windows. Counts are kept as cumulative sums over days, so the
+total of any window is a difference of two rows.
+
+@author: pablo.otero@ieo.es
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Polarity thresholds, as in the sentiment pie chart
+POSITIVE = 0.3
+NEGATIVE = -0.3
+
+SENTIMENTS = np.array(['Positives', 'Negatives', 'Neutrals'], dtype=object)
+
+
+def _cumulative(counts):
+    """
+    Cumulative sums over the first axis, with a leading row of zeros
+    """
+    zeros = np.zeros((1,) + counts.shape[1:], dtype=np.int64)
+    return np.concatenate([zeros, np.cumsum(counts, axis=0)])
+
+
+def build_daily_aggregates(df, countries):
+    """
+    Aggregate the tweets per day: volume, sentiment, country and hashtag
+    counts. countries is the dimension table of df['country_id'].
+    """
+    days = pd.to_datetime(df['created_at']).dt.floor('d')
+    first = days.min()
+    day = (days - first).dt.days.values.astype(np.int64)
+    n_days = int(day.max()) + 1
+
+    volume = np.bincount(day, minlength=n_days)
+
+    polarity = df['polarity'].values
+    sentiment = np.where(polarity > POSITIVE, 0, np.where(polarity < NEGATIVE, 1, 2))
+    sentiment = np.bincount(day * 3 + sentiment, minlength=n_days * 3).reshape(n_days, 3)
+
+    n_countries = len(countries)
+    country = df['country_id'].values
+    located = country >= 0
+    by_country = np.bincount(day[located] * n_countries + country[located],
+                             minlength=n_days * n_countries).reshape(n_days, n_countries)
+
+    # Hashtags are split as in sort_hashtags and kept as (day, hashtag, count)
+    # triplets sorted by day; there are too many of them for a dense table
+    tags = df['hashtags'].dropna().str.replace(' ', '').str.split(',').explode()
+    tag_codes, tag_names = pd.factorize(tags)
+    tag_day = day[df.index.get_indexer(tags.index)]
+    n_tags = len(tag_names)
+    pairs, tag_counts = np.unique(tag_day * n_tags + tag_codes, return_counts=True)
+
+    return {
+        "dates": pd.date_range(first, periods=n_days, freq='D'),
+        "volume": volume,
+        "volume_cum": _cumulative(volume),
+        "sentiment_cum": _cumulative(sentiment),
+        "country_cum": _cumulative(by_country),
+        "country_names": countries['name'].values,
+        "hashtag_names": np.asarray(tag_names, dtype=object),
+        "hashtag_codes": pairs % n_tags if n_tags else pairs,
+        "hashtag_counts": tag_counts,
+        "hashtag_offsets": np.searchsorted(pairs // n_tags if n_tags else pairs,
+                                           np.arange(n_days + 1)),
+    }
+
+
+def window_days(agg, start, end):
+    """
+    Day indices [d0, d1) of the window from start to end, both included
+    """
+    dates = agg["dates"]
+    d0 = int(dates.searchsorted(pd.Timestamp(start).floor('d')))
+    d1 = int(dates.searchsorted(pd.Timestamp(end).floor('d'), side='right'))
+    return d0, max(d0, d1)
+
+
+def window_counts(agg, kind, d0, d1):
+    """
+    Names and counts of hashtags, countries or sentiments between days d0 and d1
+    """
+    if kind == "hashtags":
+        i0, i1 = agg["hashtag_offsets"][d0], agg["hashtag_offsets"][d1]
+        counts = np.bincount(agg["hashtag_codes"][i0:i1],
+                             weights=agg["hashtag_counts"][i0:i1],
+                             minlength=len(agg["hashtag_names"]))
+        return agg["hashtag_names"], counts
+    if kind == "countries":
+        return agg["country_names"], agg["country_cum"][d1] - agg["country_cum"][d0]
+    return SENTIMENTS, agg["sentiment_cum"][d1] - agg["sentiment_cum"][d0]
+
+
+def compare_windows(agg, kind, window_a, window_b, n=10):
+    """
+    Ranked differences between a reference window_a and window_b, each a
+    (start, end) pair of dates
+
+    Hashtags and countries are compared in tweets per day, so windows of
+    different length are comparable, and ranked by change: the n most rising
+    then the n most falling. Sentiments are compared as percentage of the
+    tweets in each window.
+
+    The result is empty when either window holds no tweets, there is
+    nothing to compare then.
+    """
+    a0, a1 = window_days(agg, *window_a)
+    b0, b1 = window_days(agg, *window_b)
+    names, counts_a = window_counts(agg, kind, a0, a1)
+    _, counts_b = window_counts(agg, kind, b0, b1)
+
+    volume = agg["volume_cum"]
+    if volume[a1] == volume[a0] or volume[b1] == volume[b0]:
+        return pd.DataFrame(columns=["name", "window_a", "window_b", "change", "growth"])
+
+    if kind == "sentiment":
+        value_a = 100.0 * counts_a / counts_a.sum()
+        value_b = 100.0 * counts_b / counts_b.sum()
+    else:
+        value_a = counts_a / (a1 - a0)
+        value_b = counts_b / (b1 - b0)
+
+    change = value_b - value_a
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(value_a > 0, 100.0 * change / value_a, np.nan)
+
+    if kind == "sentiment":
+        order = np.arange(len(names))
+    else:
+        order = np.argsort(-change, kind='stable')
+        rising = order[:n][change[order[:n]] > 0]
+        falling = order[::-1][:n][change[order[::-1][:n]] < 0]
+        order = np.concatenate([rising, falling[::-1]])
+
+    return pd.DataFrame({
+        "name": names[order],
+        "window_a": value_a[order],
+        "window_b": value_b[order],
+        "change": change[order],
+        "growth": growth[order],
+    })
@@ -8,16 +8,45 @@ Last version: May 2021
 
 import os
 import pathlib
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+_t_start = time.perf_counter()
+
 import plotly.express as px
-import plotly.figure_factory as ff
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import pandas as pd
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+from flask import jsonify
 import plotly.graph_objects as go
 import dash_daq as daq
-import networkx as nx
+import numpy as np
+from figures import template, bar_chart, change_chart, hexbin_map, network_graph
+from locations import load_aliases, normalize_locations, top_locations
+from aggregates import build_daily_aggregates, compare_windows
+# networkx is heavy; it is imported on first use
+
+
+# Startup timings in seconds per phase, also served by /ready
+startup_timings = {"imports": round(time.perf_counter() - _t_start, 3)}
+
+
+@contextmanager
+def timed_phase(name):
+    """
+    Record and report the wall time spent in a startup phase
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round(time.perf_counter() - t0, 3)
+        print("Startup phase '{0}' took {1:.3f} s".format(name, startup_timings[name]), flush=True)
 
 
 # Initialize app
@@ -41,11 +70,26 @@ APP_PATH = str(pathlib.Path(__file__).parent.resolve())
 # Read tweets from public url in Google drive
 url = 'https://drive.google.com/file/d/1LTJOExzF6aWREh_0AFLWloDN97LNE-nX/view?usp=sharing'
 path = 'https://drive.google.com/uc?export=download&id='+url.split('/')[-2]
-df = pd.read_csv(path)
-
-
-df = df.loc[(df['lat'] > -89) & (df['lat'] < 89) & (df['lon'] > -179) & (df['lon'] < 179)]
-df.loc[df.city_from_profile == 'City of Westminster', 'city_from_profile'] = "London"
+# A local csv or another url can be used instead, e.g. by the load tests
+path = os.environ.get('TWILITTER_DATA', path)
+
+# Seconds a callback waits for the data before giving up. Keep it short: with
+# the default sync gunicorn worker a waiting callback holds the only request
+# slot of the worker, so /healthz cannot answer meanwhile.
+DATA_WAIT_TIMEOUT = float(os.environ.get('DATA_WAIT_TIMEOUT', 5))
+
+# Failed loads before callbacks report the error instead of waiting. The
+# load is retried anyway, waiting 2, 4, 8... s between attempts up to
+# DATA_RETRY_MAX_DELAY s.
+DATA_LOAD_ATTEMPTS = int(os.environ.get('DATA_LOAD_ATTEMPTS', 4))
+DATA_RETRY_MAX_DELAY = float(os.environ.get('DATA_RETRY_MAX_DELAY', 300))
+
+# Filled by load_data() in a background thread, so gunicorn workers can
+# answer /healthz and /ready while the csv is still being downloaded.
+# See load_data() for data_loaded and data_ready.
+data = {"df": None, "fig2": None, "cities": None, "countries": None, "daily": None, "error": None}
+data_loaded = threading.Event()
+data_ready = threading.Event()
 
 #mapbox style
 mapbox_style = "mapbox://styles/plotlymapbox/cjvprkf3t1kns1cqjxuxmwixz"
@@ -56,25 +100,138 @@ mapbox_style = "mapbox://styles/plotlymapbox/cjvprkf3t1kns1cqjxuxmwixz"
 mapbox_access_token = os.environ.get('MAPBOX_ACCESS_TOKEN')
 px.set_mapbox_access_token(mapbox_access_token)
 
-# Plot time series once
-df2 = (pd.to_datetime(df['created_at']).dt.floor('d').value_counts().rename_axis('date').reset_index(name='count'))
-df2 = df2.sort_values('date')
-index = pd.DatetimeIndex(df2['date']) 
-fig2 = px.area(df2, x='date', y='count', color_discrete_sequence =['#7FDBFF']*len(df2), 
-               labels={
-                     "date": "Time",
-                     "count": "Tweet volume",
-                 },
-               )
-fig2.update_xaxes(rangeslider_visible=True)
-fig2_layout = fig2["layout"]
-fig2_layout["paper_bgcolor"] = "#1f2630"
-fig2_layout["plot_bgcolor"] = "#1f2630"
-fig2_layout["font"]["color"] = "#7FDBFF"
-fig2_layout["xaxis"]["tickfont"]["color"] = "#7FDBFF"
-fig2_layout["yaxis"]["tickfont"]["color"] = "#7FDBFF"
-fig2_layout["xaxis"]["gridcolor"] = "#5b5b5b"
-fig2_layout["yaxis"]["gridcolor"] = "#5b5b5b"     
+
+def create_time_series(daily):
+    """
+    Plot the daily tweet volume, built once at startup
+    """
+    df2 = pd.DataFrame({'date': daily['dates'], 'count': daily['volume']})
+    fig2 = px.area(df2, x='date', y='count', color_discrete_sequence =['#7FDBFF']*len(df2), 
+                   labels={
+                         "date": "Time",
+                         "count": "Tweet volume",
+                     },
+                   )
+    fig2.update_xaxes(rangeslider_visible=True)
+    fig2_layout = fig2["layout"]
+    fig2_layout["paper_bgcolor"] = "#1f2630"
+    fig2_layout["plot_bgcolor"] = "#1f2630"
+    fig2_layout["font"]["color"] = "#7FDBFF"
+    fig2_layout["xaxis"]["tickfont"]["color"] = "#7FDBFF"
+    fig2_layout["yaxis"]["tickfont"]["color"] = "#7FDBFF"
+    fig2_layout["xaxis"]["gridcolor"] = "#5b5b5b"
+    fig2_layout["yaxis"]["gridcolor"] = "#5b5b5b"     
+    
+    return fig2
+
+
+def read_data():
+    """
+    Download and prepare the tweets, then publish them in data
+    """
+    with timed_phase("download"):
+        df = pd.read_csv(path)
+    with timed_phase("clean"):
+        df = df.loc[(df['lat'] > -89) & (df['lat'] < 89) & (df['lon'] > -179) & (df['lon'] < 179)]
+    with timed_phase("normalize_locations"):
+        aliases = load_aliases(os.path.join(APP_PATH, "data", "location_aliases.csv"))
+        df, cities, countries = normalize_locations(df, aliases)
+    with timed_phase("daily_aggregates"):
+        daily = build_daily_aggregates(df, countries)
+    with timed_phase("time_series"):
+        fig2 = create_time_series(daily)
+    
+    data["df"] = df
+    data["fig2"] = fig2
+    data["cities"] = cities
+    data["countries"] = countries
+    data["daily"] = daily
+
+
+def load_data():
+    """
+    Load the tweets, retrying with a capped exponential backoff until it
+    works. Runs in a background thread started at import.
+
+    data_ready is set on success. data_loaded is set on success or after
+    DATA_LOAD_ATTEMPTS failures, so callbacks stop waiting and report the
+    error while the retries go on.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            read_data()
+        except Exception as e:
+            delay = min(2 ** attempt, DATA_RETRY_MAX_DELAY)
+            print("Data load attempt {0} failed: {1!r}, retrying in {2} s".format(attempt, e, delay), flush=True)
+            if attempt >= DATA_LOAD_ATTEMPTS:
+                data["error"] = repr(e)
+                data_loaded.set()
+            time.sleep(delay)
+        else:
+            break
+    
+    # data is complete before any waiter is woken, and data_ready is set
+    # before the error is cleared
+    data_ready.set()
+    data["error"] = None
+    data_loaded.set()
+    startup_timings["total"] = round(time.perf_counter() - _t_start, 3)
+    print("Data ready after {0:.3f} s".format(startup_timings["total"]), flush=True)
+
+
+def wait_for_data():
+    """
+    Wait for the background load. Returns True if the data is ready, False
+    if it is still loading after DATA_WAIT_TIMEOUT and raises if it failed.
+    """
+    data_loaded.wait(DATA_WAIT_TIMEOUT)
+    if data["error"]:
+        raise RuntimeError("Data could not be loaded: {0}".format(data["error"]))
+    return data_ready.is_set()
+
+
+def get_data():
+    """
+    Return the tweets dataframe, waiting for the background load if needed.
+    Callbacks fired before the data arrives are skipped.
+    """
+    if not wait_for_data():
+        raise PreventUpdate
+    return data["df"]
+
+
+def get_daily():
+    """
+    Return the per-day aggregates, waiting for the background load if needed
+    """
+    if not wait_for_data():
+        raise PreventUpdate
+    return data["daily"]
+
+
+@server.route("/healthz")
+def healthz():
+    """
+    Liveness probe: the worker is up and serving requests. The state of
+    the data is reported by /ready.
+    """
+    return jsonify(status="ok")
+
+
+@server.route("/ready")
+def ready():
+    """
+    Readiness probe: 200 once the data is loaded, 503 while loading or failed
+    """
+    if data_ready.is_set():
+        return jsonify(status="ready", pid=os.getpid(), timings=startup_timings)
+    status = "error" if data["error"] else "loading"
+    return jsonify(status=status, error=data["error"], pid=os.getpid(), timings=startup_timings), 503
+
+
+threading.Thread(target=load_data, name="load-data", daemon=True).start()
 
 
 tabs_styles = {
@@ -93,7 +250,6 @@ tab_selected_style = {
 
 # Figure template
 row_heights = [150, 500, 300]
-template = {"layout": {"paper_bgcolor": "#1f2630", "plot_bgcolor": "#1f2630"}}
 
 def blank_fig(height):
     """
@@ -110,138 +266,208 @@ def blank_fig(height):
     }
 
 
-div_tab1 = html.Div(      
-    id="root",
-    children=[
+def build_tab1(fig2, daily):
+    """
+    Build the volume analysis tab around the time series figure
+    """
+    # Compare by default the last 30 days of data with the previous 30, or
+    # the two halves of the data when it spans less than 60 days
+    first, last = daily['dates'][0], daily['dates'][-1]
+    days = pd.Timedelta(days=max(min(30, len(daily['dates']) // 2), 1))
+    one_day = pd.Timedelta(days=1)
+    window_b = (max(last - days + one_day, first), last)
+    window_a = (max(window_b[0] - days, first), max(window_b[0] - one_day, first))
+    
+    return html.Div(      
+        id="root",
+        children=[
 
 
-        html.Div(
-            id="app-container",
-            children=[
-                html.Div(
-                    id="left-column",
-                    children=[
-                        html.Div(
-                            id="heatmap-container",
-                            children=[
-                                html.P("Map of tweets' volume.",
-                                    id="heatmap-title",
-                                ),
-                                html.P("Use the box select tool to make a subset.",
-                                    id="heatmap-title2",
-                                ),
-                                dcc.Loading(
-                                    id="loading-1",
-                                    type="default",
-                                    children=[
-                                        dcc.Graph(id="county-choropleth")
-            
-                                    ]
-                                )                                                  
-                            ],
-                        ),
-                        html.Div(
-                            id="time-series-container",
-                            children=[                                                
-                                    html.P("Number of tweets over time. ",
-                                        id="time-series-title",
+            html.Div(
+                id="app-container",
+                children=[
+                    html.Div(
+                        id="left-column",
+                        children=[
+                            html.Div(
+                                id="heatmap-container",
+                                children=[
+                                    html.P("Map of tweets' volume.",
+                                        id="heatmap-title",
+                                    ),
+                                    html.P("Use the box select tool to make a subset.",
+                                        id="heatmap-title2",
                                     ),
-                                    html.P("Use the bottom selector to adjust the dates.",
-                                        id="time-series-title2",
-                                    ),                               
-                                dcc.Graph(
-                                    id='time-series',                          
-                                    figure = fig2,
-                                    style={
-                                        'bgcolor': "#1f2630",
-                                    }                             
-                                ),
-                                html.Div(id='output-container-range-slider'),
-                            ],
-                        ),
-                    ],
-                ),                
-                html.Div(
-                    [
-                        html.Div(
-                            id="indicator",
-                            className="twelve columns pretty_container",
-                            children=[
-                                html.P(
-                                    [
-                                        "Number of located Tweets",                                     
-                                    ],
-                                    className="container_title",
-                                ),
-                                dcc.Loading(                                
+                                    dcc.Loading(
+                                        id="loading-1",
+                                        type="default",
+                                        children=[
+                                            dcc.Graph(id="county-choropleth")
+            
+                                        ]
+                                    )                                                  
+                                ],
+                            ),
+                            html.Div(
+                                id="time-series-container",
+                                children=[                                                
+                                        html.P("Number of tweets over time. ",
+                                            id="time-series-title",
+                                        ),
+                                        html.P("Use the bottom selector to adjust the dates.",
+                                            id="time-series-title2",
+                                        ),                               
                                     dcc.Graph(
-                                        id='pie-chart',
+                                        id='time-series',                          
+                                        figure = fig2,
+                                        style={
+                                            'bgcolor': "#1f2630",
+                                        }                             
+                                    ),
+                                    html.Div(id='output-container-range-slider'),
+                                ],
+                            ),
+                            html.Div(
+                                id="comparison-container",
+                                children=[
+                                    html.P("Compare two periods.",
+                                        id="comparison-title",
+                                    ),
+                                    html.P("Changes from the first period to the second one.",
+                                        id="comparison-title2",
+                                    ),
+                                    html.Div(
+                                        id="comparison-controls",
+                                        children=[
+                                            dcc.DatePickerRange(
+                                                id="comparison-window-a",
+                                                min_date_allowed=first.date(),
+                                                max_date_allowed=last.date(),
+                                                start_date=window_a[0].date(),
+                                                end_date=window_a[1].date(),
+                                                display_format="DD MMM YYYY",
+                                            ),
+                                            dcc.DatePickerRange(
+                                                id="comparison-window-b",
+                                                min_date_allowed=first.date(),
+                                                max_date_allowed=last.date(),
+                                                start_date=window_b[0].date(),
+                                                end_date=window_b[1].date(),
+                                                display_format="DD MMM YYYY",
+                                            ),
+                                            dcc.Dropdown(
+                                                id="comparison-dropdown",
+                                                options=[
+                                                    {
+                                                        "label": "Rising and falling hashtags",
+                                                        "value": "hashtags",
+                                                    },
+                                                    {
+                                                        "label": "Growth per country",
+                                                        "value": "countries",
+                                                    },
+                                                    {
+                                                        "label": "Sentiment shift",
+                                                        "value": "sentiment",
+                                                    },
+                                                ],
+                                                value="hashtags",
+                                                clearable=False,
+                                            ),
+                                        ],
+                                    ),
+                                    dcc.Loading(
+                                        id="loading-3",
+                                        type="default",
+                                        children=[
+                                            dcc.Graph(id="comparison-chart")
+                                        ]
+                                    )
+                                ],
+                            ),
+                        ],
+                    ),                
+                    html.Div(
+                        [
+                            html.Div(
+                                id="indicator",
+                                className="twelve columns pretty_container",
+                                children=[
+                                    html.P(
+                                        [
+                                            "Number of located Tweets",                                     
+                                        ],
+                                        className="container_title",
+                                    ),
+                                    dcc.Loading(                                
+                                        dcc.Graph(
+                                            id='pie-chart',
+                                        )
+                                    )
+                                ], style={'width': '100%', 'display': 'inline-block'},
+                            ),                      
+                            html.Div(
+                                id="graph-container2",
+                                children=[
+                                    html.P(id="chart-selector", children="Select chart:"),
+                                    dcc.Dropdown(
+                                        id="chart-dropdown",
+                                        options=[
+                                            {
+                                                "label": "Most frequent hashtags",
+                                                "value": "hashtags",
+                                            },
+                                            {
+                                                "label": "Most successful users (favorites + retweets)",
+                                                "value": "engagement",
+                                            },
+                                            {
+                                                "label": "Most mentioned users",
+                                                "value": "mentions",
+                                            },
+                                            {
+                                                "label": "Top cities",
+                                                "value": "cities",
+                                            },
+                                            {
+                                                "label": "Top countries",
+                                                "value": "countries",
+                                            },                                
+                                        ],
+                                        value="hashtags"                           
+                                    ),
+                                    dcc.Loading(
+                                        id="loading-2",
+                                        type="default",
+                                        children=[
+                                            dcc.Graph(id="selected-data")
+                                        ]
                                     )
-                                )
-                            ], style={'width': '100%', 'display': 'inline-block'},
-                        ),                      
-                        html.Div(
-                            id="graph-container2",
-                            children=[
-                                html.P(id="chart-selector", children="Select chart:"),
-                                dcc.Dropdown(
-                                    id="chart-dropdown",
-                                    options=[
-                                        {
-                                            "label": "Most frequent hashtags",
-                                            "value": "hashtags",
-                                        },
-                                        {
-                                            "label": "Most successful users (favorites + retweets)",
-                                            "value": "engagement",
-                                        },
-                                        {
-                                            "label": "Most mentioned users",
-                                            "value": "mentions",
-                                        },
-                                        {
-                                            "label": "Top cities",
-                                            "value": "cities",
-                                        },
-                                        {
-                                            "label": "Top countries",
-                                            "value": "countries",
-                                        },                                
-                                    ],
-                                    value="hashtags"                           
-                                ),
-                                dcc.Loading(
-                                    id="loading-2",
-                                    type="default",
-                                    children=[
-                                        dcc.Graph(id="selected-data")
-                                    ]
-                                )
-                            ],
-                        ),                     
-                        html.Div(
-                            id="description3",
-                            children=[
-                                dcc.Markdown('''
+                                ],
+                            ),                     
+                            html.Div(
+                                id="description3",
+                                children=[
+                                    dcc.Markdown('''
                                              
                                              
-                                By [@PabloOteroT](https://twitter.com/PabloOteroT) 
-                                inspired in the [Dash opioid epidemic example](https://github.com/plotly/dash-sample-apps/tree/master/apps/dash-opioid-epidemic).
-                                This app is part of the work of [Instituto Español de Oceanografía](http://www.ieo.es/) in the
-                                [CleanAtlantic - Tackling Marine Litter in the Atlantic Area](http://www.cleanatlantic.eu/) project. This app 
-                                only reflects the author´s view, thus the Atlantic Area Programme authorities are not liable for any use that may be made of the
-                                information contained therein.
+                                    By [@PabloOteroT](https://twitter.com/PabloOteroT) 
+                                    inspired in the [Dash opioid epidemic example](https://github.com/plotly/dash-sample-apps/tree/master/apps/dash-opioid-epidemic).
+                                    This app is part of the work of [Instituto Español de Oceanografía](http://www.ieo.es/) in the
+                                    [CleanAtlantic - Tackling Marine Litter in the Atlantic Area](http://www.cleanatlantic.eu/) project. This app 
+                                    only reflects the author´s view, thus the Atlantic Area Programme authorities are not liable for any use that may be made of the
+                                    information contained therein.
                                 
                         
-                                ''')
-                            ],
-                        ),
-                    ],
-                ),
+                                    ''')
+                                ],
+                            ),
+                        ],
+                    ),
                               
-            ],
-        ),             
-])
+                ],
+            ),             
+    ])
 
 
                                       
@@ -263,19 +489,13 @@ div_tab1 = html.Div(
 
 
 def create_map(dff):
-    fig = ff.create_hexbin_mapbox(data_frame=dff, lat="lat", lon="lon", 
-                                  nx_hexagon=100, opacity=0.5, 
-                                  labels={"color": "Tweet Count"}, 
-                                  color_continuous_scale="Viridis",
-                                  mapbox_style="carto-positron",
-                                  min_count=1) 
-
-    fig.update_layout(margin=dict(b=0, t=0, l=0, r=0))
-    
-    return fig
+    return hexbin_map(dff['lat'].values, dff['lon'].values, nx_hexagon=100)
 
 
+# The spring layout is random and the network fixed, build it once per worker
+@lru_cache(maxsize=1)
 def load_network():
+    import networkx as nx
      
     #The good option would be to read it locally from file, but Heroku does
     #not allow to read static files  
@@ -382,82 +602,11 @@ def load_network():
       
     pos = nx.spring_layout(G, k=2)
     
-    # edges trace
-    edge_x = []
-    edge_y = []
-    for edge in G.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_x.append(x0)
-        edge_x.append(x1)
-        edge_x.append(None)
-        edge_y.append(y0)
-        edge_y.append(y1)
-        edge_y.append(None)
-
-    edge_trace = go.Scatter(
-        x=edge_x, y=edge_y,
-        line=dict(color="#7FDBFF", width=1),
-        hoverinfo='none',
-        showlegend=False,
-        mode='lines')
-
-    # nodes trace
-    node_x = []
-    node_y = []
-    text = []
-    for node in G.nodes():
-        x, y = pos[node]
-        node_x.append(x)
-        node_y.append(y)
-        text.append(node)
-
-    node_trace = go.Scatter(
-        x=node_x, y=node_y, text=text,
-        mode='markers',
-        showlegend=False,
-        hoverinfo='text',
-        marker=dict(
-                showscale=True,
-                # colorscale options
-                #'Greys' | 'YlGnBu' | 'Greens' | 'YlOrRd' | 'Bluered' | 'RdBu' |
-                #'Reds' | 'Blues' | 'Picnic' | 'Rainbow' | 'Portland' | 'Jet' |
-                #'Hot' | 'Blackbody' | 'Earth' | 'Electric' | 'Viridis' |
-                colorscale='YlOrRd',
-                reversescale=False,
-                color=[],
-                size=15,
-                colorbar=dict(
-                    thickness=15,
-                    title='Node Connections',
-                    xanchor='left',
-                    titleside='right',
-                    bgcolor='white',
-                ),
-                line_width=2))
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()])
     
-    # color marker by adjacency
-    node_adjacencies = []
-    for node, adjacencies in enumerate(G.adjacency()):
-        node_adjacencies.append(len(adjacencies[1]))   
-    node_trace.marker.color = node_adjacencies
-  
-    fig = go.Figure(data=[edge_trace, node_trace],
-             layout=go.Layout(
-                title='<br>Top-100 word bigrams of the overall period.',
-                height=700,
-                titlefont_size=16,
-                titlefont_color="#d6a622",
-                plot_bgcolor="#1f2630",
-                paper_bgcolor="#1f2630",
-                showlegend=False,
-                hovermode='closest',
-                margin=dict(b=20,l=5,r=5,t=40),
-                xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
-                yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)),
-                )
-    
-    return fig
+    return network_graph(nodes, edges, np.array([pos[node] for node in nodes]))
 
 
 app.layout = html.Div([
@@ -497,7 +646,12 @@ app.layout = html.Div([
               Input('tabs-example', 'value'))
 def render_content(tab):
     if tab == 'tab-1':
-        return div_tab1
+        try:
+            if not wait_for_data():
+                return html.P("Data is still loading, please reload the page in a few seconds.")
+        except RuntimeError:
+            return html.P("The data could not be loaded yet, please try again later.")
+        return build_tab1(data["fig2"], data["daily"])
     elif tab == 'tab-2':
         return html.Div(      
             children=[
@@ -511,6 +665,7 @@ def render_content(tab):
     [Input('time-series', 'relayoutData')]
 )    
 def update_map_with_dates(relayoutData):
+    df = get_data()
     if relayoutData is None:
         return(create_map(df))            
     elif 'xaxis.range' in relayoutData:        
@@ -597,7 +752,7 @@ def sort_mentions(dff):
 )
 def display_selected_data(selected_points, chart_dropdown, relayoutData):
     
-   
+    df = get_data()
     if relayoutData is None:  
         dff=df
     else:
@@ -632,25 +787,25 @@ def display_selected_data(selected_points, chart_dropdown, relayoutData):
         except:
             pass
      
-    try:
-        date_start = pd.to_datetime(dff['created_at'].min()).strftime("%d %b %Y")
-    except:
-        date_start = pd.to_datetime(dff['created_at'].iloc[0]).strftime("%d %b %Y")
-    try:
-        date_end   = pd.to_datetime(dff['created_at'].max()).strftime("%d %b %Y")
-    except:
-        date_end   = pd.to_datetime(dff['created_at'].iloc[-1]).strftime("%d %b %Y") 
+    # An empty selection has no dates to show and nothing to rank
+    if not dff.empty:
+        try:
+            date_start = pd.to_datetime(dff['created_at'].min()).strftime("%d %b %Y")
+        except:
+            date_start = pd.to_datetime(dff['created_at'].iloc[0]).strftime("%d %b %Y")
+        try:
+            date_end   = pd.to_datetime(dff['created_at'].max()).strftime("%d %b %Y")
+        except:
+            date_end   = pd.to_datetime(dff['created_at'].iloc[-1]).strftime("%d %b %Y") 
     
 
-    if chart_dropdown == "hashtags": 
+    if dff.empty:
+        fig = bar_chart([], [], 'No tweets in the selected area and period', "", "")
+    elif chart_dropdown == "hashtags": 
         title='Most used hashtags<br>from {0} '.format(date_start) + 'to {0} '.format(date_end)        
-        fig = px.bar(sort_hashtags(dff), x="hashtag_ordered_keys", y='hashtag_ordered_values', \
-                     title=title, color_discrete_sequence =['#7FDBFF']*len(dff),
-                     labels={
-                     "hashtag_ordered_keys": "Top hashtags",
-                     "hashtag_ordered_values": "Frequency",
-                     },
-        )            
+        df2 = sort_hashtags(dff)
+        fig = bar_chart(df2['hashtag_ordered_keys'], df2['hashtag_ordered_values'],
+                        title, "Top hashtags", "Frequency")
     elif chart_dropdown == "engagement":
         dff_engagement = dff[['original_author', 'engagement']]
         dff_engagement = dff_engagement.groupby(by=['original_author'], as_index=False).sum()
@@ -658,66 +813,25 @@ def display_selected_data(selected_points, chart_dropdown, relayoutData):
         dff_engagement['original_author'] = ['@' + element for element in dff_engagement.original_author]
 
         title='Users with more engagement<br>from {0} '.format(date_start) + 'to {0} '.format(date_end)
-        fig = px.bar(dff_engagement, x="original_author", y='engagement', \
-                     title=title, color_discrete_sequence =['#7FDBFF']*len(dff_engagement),
-                     labels={
-                     "original_author": "User name",
-                     "engagement": "Engagement",
-                     },
-        )               
+        fig = bar_chart(dff_engagement['original_author'], dff_engagement['engagement'],
+                        title, "User name", "Engagement")
     elif chart_dropdown == "mentions":
         title='Most mentioned users<br>from {0} '.format(date_start) + 'to {0} '.format(date_end)        
-
-        fig = px.bar(sort_mentions(dff), x="mentions_ordered_keys", y='mentions_ordered_values', \
-                     title=title, color_discrete_sequence =['#7FDBFF']*len(dff),
-                     labels={
-                     "mentions_ordered_keys": "User name",
-                     "mentions_ordered_values": "Mentions",
-                     },
-        )
+        df3 = sort_mentions(dff)
+        fig = bar_chart(df3['mentions_ordered_keys'], df3['mentions_ordered_values'],
+                        title, "User name", "Mentions")
     elif chart_dropdown == "cities":
-        dff_cities = dff[['city_from_profile']].dropna()
-        dff_cities = dff_cities['city_from_profile'].value_counts()
-        dff_cities=dff_cities[:20]
+        names, counts = top_locations(dff['city_id'].values, data["cities"], 20)
         title='Cities with more tweets<br>from {0} '.format(date_start) + 'to {0} '.format(date_end)        
 
-        fig = px.bar(dff_cities, x=dff_cities.index, y='city_from_profile', \
-                     title=title, color_discrete_sequence =['#7FDBFF']*len(dff_cities),
-                     labels={
-                     "x": "Top cities",
-                     "city_from_profile": "Tweet volume from city",
-                     },
-        )
+        fig = bar_chart(names, counts,
+                        title, "Top cities", "Tweet volume from city")
     else:
-        dff_countries = dff[['country_from_profile']].dropna()
-        dff_countries = dff_countries['country_from_profile'].value_counts()
-        dff_countries=dff_countries[:20]
+        names, counts = top_locations(dff['country_id'].values, data["countries"], 20)
         title='Countries with more tweets<br>from {0} '.format(date_start) + 'to {0} '.format(date_end)        
         
-        fig = px.bar(dff_countries, x=dff_countries.index, y='country_from_profile', \
-                     title=title, color_discrete_sequence =['#7FDBFF']*len(dff_countries),
-                     labels={
-                     "x": "Top countries",
-                     "country_from_profile": "Tweet volume from country",
-                     },
-        )
-               
-
-    fig_layout = fig["layout"]
-    fig_layout["hovermode"] = "closest"
-    fig_layout["legend"] = dict(orientation="v")
-    fig_layout["autosize"] = True
-    fig_layout["paper_bgcolor"] = "#1f2630"
-    fig_layout["plot_bgcolor"] = "#1f2630"
-    fig_layout["font"]["color"] = "#7FDBFF"
-    fig_layout["xaxis"]["tickfont"]["color"] = "#7FDBFF"
-    fig_layout["yaxis"]["tickfont"]["color"] = "#7FDBFF"
-    fig_layout["xaxis"]["gridcolor"] = "#5b5b5b"
-    fig_layout["yaxis"]["gridcolor"] = "#5b5b5b" 
-    fig_layout["margin"]["t"] = 75
-    fig_layout["margin"]["r"] = 50
-    fig_layout["margin"]["b"] = 100
-    fig_layout["margin"]["l"] = 50       
+        fig = bar_chart(names, counts,
+                        title, "Top countries", "Tweet volume from country")
 
 
     # Build sentiment count figure
@@ -758,5 +872,46 @@ def display_selected_data(selected_points, chart_dropdown, relayoutData):
     )
 
 
+@app.callback(
+    Output("comparison-chart", "figure"),
+    [
+        Input("comparison-window-a", "start_date"),
+        Input("comparison-window-a", "end_date"),
+        Input("comparison-window-b", "start_date"),
+        Input("comparison-window-b", "end_date"),
+        Input("comparison-dropdown", "value"),
+    ],
+)
+def display_comparison(start_a, end_a, start_b, end_b, kind):
+    daily = get_daily()
+    if None in (start_a, end_a, start_b, end_b):
+        raise PreventUpdate
+    
+    dff = compare_windows(daily, kind, (start_a, end_a), (start_b, end_b))
+    period = '{0} - {1} vs {2} - {3}'.format(*[pd.to_datetime(d).strftime("%d %b %Y")
+                                                for d in (start_b, end_b, start_a, end_a)])
+    if dff.empty:
+        return change_chart([], [], 'No tweets to compare<br>{0}'.format(period), "", "", [], "")
+    
+    customdata = np.stack([dff['window_a'], dff['window_b'], dff['growth']], axis=-1)
+    per_day_hover = ("%{x}<br>%{customdata[0]:.2f} -> %{customdata[1]:.2f} tweets per day"
+                     "<br>%{customdata[2]:+.0f}%<extra></extra>")
+    
+    if kind == "hashtags":
+        title = 'Rising and falling hashtags<br>{0}'.format(period)
+        fig = change_chart('#' + dff['name'], dff['change'], title, "Hashtags", "Change in tweets per day",
+                           customdata, per_day_hover)
+    elif kind == "countries":
+        title = 'Growth per country<br>{0}'.format(period)
+        fig = change_chart(dff['name'], dff['change'], title, "Countries", "Change in tweets per day",
+                           customdata, per_day_hover)
+    else:
+        title = 'Sentiment shift<br>{0}'.format(period)
+        fig = change_chart(dff['name'], dff['change'], title, "Sentiment", "Change in share (points)",
+                           customdata, "%{x}<br>%{customdata[0]:.1f}% -> %{customdata[1]:.1f}%<extra></extra>")
+    
+    return fig
+
+
 if __name__ == "__main__":
     app.run_server(debug=True)
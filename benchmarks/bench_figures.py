@@ -0,0 +1,147 @@
+"""
+Benchmark of the figure builders in figures.py against the previous
+plotly express / figure_factory code, on synthetic data.
+
+Reports the construction time and the size of the JSON sent to the browser.
+Run from the repository root:
+
+    python benchmarks/bench_figures.py [n_tweets]
+
+@author: pablo.otero@ieo.es
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.figure_factory as ff
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from figures import bar_chart, hexbin_map, network_graph  # noqa: E402
+
+
+def old_map(dff):
+    fig = ff.create_hexbin_mapbox(data_frame=dff, lat="lat", lon="lon",
+                                  nx_hexagon=100, opacity=0.5,
+                                  labels={"color": "Tweet Count"},
+                                  color_continuous_scale="Viridis",
+                                  mapbox_style="carto-positron",
+                                  min_count=1)
+    fig.update_layout(margin=dict(b=0, t=0, l=0, r=0))
+    return fig
+
+
+def new_map(dff):
+    return hexbin_map(dff['lat'].values, dff['lon'].values, nx_hexagon=100)
+
+
+def old_bar(counts):
+    fig = px.bar(counts, x=counts.index, y='city_from_profile',
+                 title='Cities', color_discrete_sequence=['#7FDBFF']*len(counts),
+                 labels={"x": "Top cities", "city_from_profile": "Tweet volume from city"})
+    fig_layout = fig["layout"]
+    fig_layout["hovermode"] = "closest"
+    fig_layout["legend"] = dict(orientation="v")
+    fig_layout["autosize"] = True
+    fig_layout["paper_bgcolor"] = "#1f2630"
+    fig_layout["plot_bgcolor"] = "#1f2630"
+    fig_layout["font"]["color"] = "#7FDBFF"
+    fig_layout["xaxis"]["tickfont"]["color"] = "#7FDBFF"
+    fig_layout["yaxis"]["tickfont"]["color"] = "#7FDBFF"
+    fig_layout["xaxis"]["gridcolor"] = "#5b5b5b"
+    fig_layout["yaxis"]["gridcolor"] = "#5b5b5b"
+    fig_layout["margin"]["t"] = 75
+    fig_layout["margin"]["r"] = 50
+    fig_layout["margin"]["b"] = 100
+    fig_layout["margin"]["l"] = 50
+    return fig
+
+
+def new_bar(counts):
+    return bar_chart(counts.index, counts.values, 'Cities', "Top cities", "Tweet volume from city")
+
+
+def old_network(G, pos):
+    edge_x = []
+    edge_y = []
+    for edge in G.edges():
+        x0, y0 = pos[edge[0]]
+        x1, y1 = pos[edge[1]]
+        edge_x.extend([x0, x1, None])
+        edge_y.extend([y0, y1, None])
+    edge_trace = go.Scatter(x=edge_x, y=edge_y, line=dict(color="#7FDBFF", width=1),
+                            hoverinfo='none', showlegend=False, mode='lines')
+    node_x = []
+    node_y = []
+    text = []
+    for node in G.nodes():
+        x, y = pos[node]
+        node_x.append(x)
+        node_y.append(y)
+        text.append(node)
+    node_trace = go.Scatter(
+        x=node_x, y=node_y, text=text, mode='markers', showlegend=False, hoverinfo='text',
+        marker=dict(showscale=True, colorscale='YlOrRd', reversescale=False, color=[], size=15,
+                    colorbar=dict(thickness=15, title='Node Connections', xanchor='left',
+                                  titleside='right', bgcolor='white'),
+                    line_width=2))
+    node_adjacencies = []
+    for node, adjacencies in enumerate(G.adjacency()):
+        node_adjacencies.append(len(adjacencies[1]))
+    node_trace.marker.color = node_adjacencies
+    return go.Figure(data=[edge_trace, node_trace],
+                     layout=go.Layout(
+                         title='<br>Top-100 word bigrams of the overall period.',
+                         height=700, titlefont_size=16, titlefont_color="#d6a622",
+                         plot_bgcolor="#1f2630", paper_bgcolor="#1f2630",
+                         showlegend=False, hovermode='closest',
+                         margin=dict(b=20, l=5, r=5, t=40),
+                         xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                         yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)))
+
+
+def new_network(G, pos):
+    nodes = list(G.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in G.edges()])
+    return network_graph(nodes, edges, np.array([pos[node] for node in nodes]))
+
+
+def payload(fig):
+    """
+    Size in KB of the figure as serialized by Dash
+    """
+    return len(json.dumps(fig, cls=PlotlyJSONEncoder)) / 1024
+
+
+def run(name, old, new, *args, number=5):
+    t_old = min(timeit.repeat(lambda: old(*args), number=number, repeat=3)) / number
+    t_new = min(timeit.repeat(lambda: new(*args), number=number, repeat=3)) / number
+    print("{0:<10} {1:>10.2f} {2:>10.2f} {3:>8.1f}x {4:>12.1f} {5:>12.1f}".format(
+        name, t_old * 1000, t_new * 1000, t_old / t_new, payload(old(*args)), payload(new(*args))))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = np.random.default_rng(0)
+    dff = pd.DataFrame({"lat": rng.uniform(-60, 70, n), "lon": rng.uniform(-170, 170, n)})
+    cities = pd.Series(rng.choice(["city%d" % i for i in range(500)], n),
+                       name="city_from_profile").value_counts()[:20]
+    G = nx.read_edgelist(os.path.join(ROOT, "data", "tweets.edgelist"))
+    pos = nx.spring_layout(G, k=2, seed=0)
+
+    print("{0} tweets".format(n))
+    print("{0:<10} {1:>10} {2:>10} {3:>9} {4:>12} {5:>12}".format(
+        "figure", "old (ms)", "new (ms)", "speedup", "old (KB)", "new (KB)"))
+    run("map", old_map, new_map, dff, number=1)
+    run("bar", old_bar, new_bar, cities)
+    run("network", old_network, new_network, G, pos)
@@ -0,0 +1,500 @@
+"""
+Load test of the Twilitter Dash App under gunicorn
+
+Starts app:server under gunicorn on a synthetic dataset, replays dashboard
+sessions (tab switches, time slider drags, dropdown switches, box
+selections on the map, period comparisons) from concurrent virtual users,
+and reports throughput, latency percentiles per callback and the memory of
+the workers over time. Every combination of worker class, number of workers
+and concurrency given on the command line is run in turn.
+
+Sessions are synthesized by default. Real ones can be recorded in the
+browser (developer tools > Network > Save all as HAR) and replayed with
+--har; every POST to /_dash-update-component in the file is replayed in
+order as one session.
+
+Linux only, worker memory is read from /proc. Run from the repository root:
+
+    python benchmarks/loadtest.py --worker-class sync gthread --workers 1 2 \\
+        --concurrency 4 16 --duration 30
+
+@author: pablo.otero@ieo.es
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CALLBACK_PATH = "/_dash-update-component"
+
+CHARTS = ["hashtags", "engagement", "mentions", "cities", "countries"]
+
+# Shortest dataset, in days from the first to the last tweet, that leaves
+# room for two comparison windows and a slider range
+MIN_SPAN_DAYS = 2
+
+
+# Synthetic dataset
+# -----------------
+
+def make_dataset(path, n, seed=0, start="2020-01-01", days=365):
+    """
+    Write a csv of n fake tweets with the columns used by the app
+    """
+    rng = np.random.default_rng(seed)
+    places = [("London", "United Kingdom"), ("City of Westminster", "UK"),
+              ("Madrid", "España"), ("Vigo", "Spain"), ("New York", "United States"),
+              ("NYC", "USA"), ("Paris", "France"), ("Tokyo", "日本"),
+              ("Lisboa", "Portugal"), ("Sydney", "Australia")]
+    places += [("City %d" % i, "Country %d" % (i % 60)) for i in range(400)]
+    hashtags = np.array(["plastic", "ocean", "beachcleanup", "marinelitter", "pollution",
+                         "microplastics", "zerowaste", "savetheocean", "recycle", "climate"]
+                        + ["tag%d" % i for i in range(2000)], dtype=object)
+    users = np.array(["user%d" % i for i in range(5000)], dtype=object)
+
+    # Zipf-like popularity, a few places, hashtags and users dominate
+    def pick(values, size):
+        p = 1.0 / np.arange(1, len(values) + 1)
+        return rng.choice(len(values), size=size, p=p / p.sum())
+
+    place = pick(places, n)
+    located = rng.random(n) < 0.7
+
+    def joined(values, present, max_items):
+        rows = np.flatnonzero(present)
+        sizes = rng.integers(1, max_items + 1, len(rows))
+        items = np.split(values[pick(values, sizes.sum())], np.cumsum(sizes)[:-1])
+        out = np.full(n, None, dtype=object)
+        out[rows] = [", ".join(i) for i in items]
+        return out
+
+    df = pd.DataFrame({
+        "created_at": pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 86400, n), unit="s"),
+        "lat": np.clip(rng.normal(30, 25, n), -85, 85),
+        "lon": np.clip(rng.normal(0, 70, n), -175, 175),
+        "city_from_profile": [places[i][0] if ok else None for i, ok in zip(place, located)],
+        "country_from_profile": [places[i][1] if ok else None for i, ok in zip(place, located)],
+        "hashtags": joined(hashtags, rng.random(n) < 0.6, 4),
+        "user_mentions": joined(users, rng.random(n) < 0.4, 3),
+        "original_author": users[pick(users, n)],
+        "engagement": rng.geometric(0.05, n) - 1,
+        "polarity": np.clip(rng.normal(0.05, 0.4, n), -1, 1),
+    })
+    df.sort_values("created_at").to_csv(path, index=False)
+    return df["created_at"].min(), df["created_at"].max()
+
+
+# Dash callback requests
+# ----------------------
+
+def callback_request(outputs, inputs, changed):
+    """
+    Body of a POST to /_dash-update-component. outputs is a list of
+    (id, property), inputs a list of (id, property, value) and changed the
+    id.property that triggered the callback.
+    """
+    if len(outputs) == 1:
+        output = "{0}.{1}".format(*outputs[0])
+        outputs_list = {"id": outputs[0][0], "property": outputs[0][1]}
+    else:
+        output = ".." + "...".join("{0}.{1}".format(*o) for o in outputs) + ".."
+        outputs_list = [{"id": i, "property": p} for i, p in outputs]
+    return {
+        "output": output,
+        "outputs": outputs_list,
+        "inputs": [{"id": i, "property": p, "value": v} for i, p, v in inputs],
+        "changedPropIds": [changed],
+        "state": [],
+    }
+
+
+def render_tab(tab):
+    return ("render_content", callback_request(
+        [("tabs-example-content", "children")],
+        [("tabs-example", "value", tab)], "tabs-example.value"))
+
+
+def update_map(relayout):
+    return ("update_map_with_dates", callback_request(
+        [("county-choropleth", "figure")],
+        [("time-series", "relayoutData", relayout)], "time-series.relayoutData"))
+
+
+def selected_data(selected, chart, relayout, changed):
+    return ("display_selected_data", callback_request(
+        [("selected-data", "figure"), ("pie-chart", "figure")],
+        [("county-choropleth", "selectedData", selected),
+         ("chart-dropdown", "value", chart),
+         ("time-series", "relayoutData", relayout)], changed))
+
+
+def comparison(window_a, window_b, kind, changed):
+    return ("display_comparison", callback_request(
+        [("comparison-chart", "figure")],
+        [("comparison-window-a", "start_date", window_a[0]),
+         ("comparison-window-a", "end_date", window_a[1]),
+         ("comparison-window-b", "start_date", window_b[0]),
+         ("comparison-window-b", "end_date", window_b[1]),
+         ("comparison-dropdown", "value", kind)], changed))
+
+
+def synthesize_session(rng, first, last, actions=12):
+    """
+    A dashboard session: page load and a random sequence of user actions,
+    with the callbacks the browser would fire for each of them
+
+    Slider ranges span at least a week and comparison windows a month, or
+    less when the dataset is too short for that.
+    """
+    span = (last - first).days
+    if span < MIN_SPAN_DAYS:
+        raise ValueError("The dataset spans {0} days, at least {1} are needed to synthesize "
+                         "sessions".format(span, MIN_SPAN_DAYS))
+    slider_days = min(7, span)
+    window_days = min(30, span // 2)
+
+    def day(d):
+        return (first + pd.Timedelta(days=int(d))).strftime("%Y-%m-%d")
+
+    relayout, selected, chart = None, None, "hashtags"
+    window_b = (day(span - window_days + 1), day(span))
+    window_a = (day(span - 2 * window_days + 1), day(span - window_days))
+    session = [render_tab("tab-1"), update_map(relayout),
+               selected_data(selected, chart, relayout, "chart-dropdown.value"),
+               comparison(window_a, window_b, "hashtags", "comparison-dropdown.value")]
+
+    for _ in range(actions):
+        action = rng.choices(["slider", "dropdown", "select", "compare", "network"],
+                             weights=[4, 3, 2, 1, 0.5])[0]
+        if action == "slider":
+            d0 = rng.randrange(0, span - slider_days + 1)
+            d1 = rng.randrange(d0 + slider_days, span + 1)
+            relayout = {"xaxis.range": [day(d0), day(d1)]}
+            session += [update_map(relayout),
+                        selected_data(selected, chart, relayout, "time-series.relayoutData")]
+        elif action == "dropdown":
+            chart = rng.choice([c for c in CHARTS if c != chart])
+            session.append(selected_data(selected, chart, relayout, "chart-dropdown.value"))
+        elif action == "select":
+            lon0, lat0 = rng.uniform(-150, 100), rng.uniform(-40, 50)
+            lon1, lat1 = lon0 + rng.uniform(10, 60), lat0 + rng.uniform(5, 30)
+            selected = {"points": [], "range": {"mapbox": [[lon0, lat1], [lon1, lat0]]}}
+            session.append(selected_data(selected, chart, relayout, "county-choropleth.selectedData"))
+        elif action == "compare":
+            d = rng.randrange(window_days, span - window_days + 2)
+            window_a = (day(d - window_days), day(d - 1))
+            window_b = (day(d), day(d + window_days - 1))
+            kind = rng.choice(["hashtags", "countries", "sentiment"])
+            session.append(comparison(window_a, window_b, kind, "comparison-window-b.end_date"))
+        else:
+            session += [render_tab("tab-2"), render_tab("tab-1"), update_map(relayout),
+                        selected_data(selected, chart, relayout, "chart-dropdown.value")]
+    return session
+
+
+def load_har(path):
+    """
+    One session with the Dash callbacks recorded in a HAR file
+    """
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)["log"]["entries"]
+    session = []
+    for entry in entries:
+        request = entry["request"]
+        if request["method"] != "POST" or not request["url"].endswith(CALLBACK_PATH):
+            continue
+        body = json.loads(request["postData"]["text"])
+        session.append((body["output"], body))
+    return session
+
+
+# Server
+# ------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app, data_path, worker_class, workers, threads, port, timeout):
+    """
+    Start gunicorn and wait until every worker has loaded the data
+    """
+    cmd = [sys.executable, "-m", "gunicorn", app, "--chdir", ROOT,
+           "--bind", "127.0.0.1:{0}".format(port), "--workers", str(workers),
+           "--worker-class", worker_class, "--timeout", "120"]
+    if worker_class == "gthread":
+        cmd += ["--threads", str(threads)]
+    env = dict(os.environ, TWILITTER_DATA=data_path)
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    # /ready answers from whichever worker takes the connection, with its
+    # pid: wait until every worker has answered 200
+    deadline = time.time() + timeout
+    ready = set()
+    while len(ready) < workers:
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            log.seek(0)
+            raise RuntimeError("gunicorn did not become ready:\n" + log.read().decode(errors="replace"))
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/ready", headers={"Connection": "close"})
+            response = conn.getresponse()
+            if response.status == 200:
+                ready.add(json.loads(response.read())["pid"])
+            conn.close()
+        except OSError:
+            pass
+        time.sleep(0.1)
+    return proc
+
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def worker_pids(master):
+    """
+    Pids of the gunicorn workers, the children of the master process
+    """
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open("/proc/{0}/stat".format(name)) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(")", 1)[1].split()[1]) == master:
+            pids.append(int(name))
+    return pids
+
+
+def rss_mb(pid):
+    try:
+        with open("/proc/{0}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+class MemorySampler(threading.Thread):
+    """
+    Sample the resident memory of the workers at a fixed interval
+    """
+
+    def __init__(self, master, interval, t0):
+        super().__init__(daemon=True)
+        self.master = master
+        self.interval = interval
+        self.t0 = t0
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = [rss_mb(pid) for pid in worker_pids(self.master)]
+            self.samples.append((round(time.time() - self.t0, 1), round(sum(rss), 1),
+                                 round(max(rss, default=0), 1)))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+# Replay
+# ------
+
+def virtual_user(port, sessions, rng, think, t_end, results):
+    """
+    Replay sessions until t_end, appending (name, start, latency, status,
+    bytes) for each request to results
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    headers = {"Content-Type": "application/json"}
+    while time.time() < t_end:
+        for name, body in rng.choice(sessions):
+            if time.time() >= t_end:
+                break
+            payload = json.dumps(body)
+            t0 = time.time()
+            try:
+                conn.request("POST", CALLBACK_PATH, payload, headers)
+                response = conn.getresponse()
+                size = len(response.read())
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                size, status = 0, 0
+            results.append((name, t0, time.time() - t0, status, size))
+            if think:
+                time.sleep(rng.uniform(0, 2 * think))
+    conn.close()
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"p50": round(p50, 1), "p95": round(p95, 1), "p99": round(p99, 1),
+            "max": round(max(latencies) * 1000, 1)}
+
+
+def run_config(args, sessions, worker_class, workers, concurrency):
+    port = free_port()
+    proc = start_server(args.app, args.data, worker_class, workers, args.threads,
+                        port, args.startup_timeout)
+    try:
+        t0 = time.time()
+        sampler = MemorySampler(proc.pid, args.sample_interval, t0)
+        sampler.start()
+        results = []
+        t_end = t0 + args.duration
+        users = [threading.Thread(target=virtual_user,
+                                  args=(port, sessions, random.Random(args.seed + i),
+                                        args.think, t_end, results))
+                 for i in range(concurrency)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.time() - t0
+        sampler.stop()
+    finally:
+        stop_server(proc)
+
+    ok = [r for r in results if r[3] in (200, 204)]
+    by_callback = defaultdict(list)
+    for name, _, latency, _, _ in ok:
+        by_callback[name].append(latency)
+    return {
+        "worker_class": worker_class,
+        "workers": workers,
+        "threads": args.threads if worker_class == "gthread" else 1,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        # status 0 is a connection error
+        "errors_by_status": {str(k): v for k, v in sorted(
+            Counter(r[3] for r in results if r[3] not in (200, 204)).items())},
+        "throughput": round(len(ok) / elapsed, 2),
+        "kb_per_response": round(sum(r[4] for r in ok) / max(len(ok), 1) / 1024, 1),
+        "latency_ms": percentiles([r[2] for r in ok]),
+        "latency_ms_by_callback": {name: dict(percentiles(v), n=len(v))
+                                   for name, v in sorted(by_callback.items())},
+        # (seconds since start, total RSS of the workers in MB, largest worker in MB)
+        "memory_mb": sampler.samples,
+    }
+
+
+def print_report(result):
+    print("\n{worker_class} workers={workers} threads={threads} concurrency={concurrency}".format(**result))
+    errors = "{0} errors".format(result["errors"])
+    if result["errors"]:
+        errors += " by status {0}".format(result["errors_by_status"])
+    print("  {0} requests, {1}, {2} req/s, {3} KB per response".format(
+        result["requests"], errors, result["throughput"], result["kb_per_response"]))
+    print("  {0:<24} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9}".format(
+        "latency (ms)", "n", "p50", "p95", "p99", "max"))
+    for name, p in result["latency_ms_by_callback"].items():
+        print("  {0:<24} {n:>6} {p50:>9} {p95:>9} {p99:>9} {max:>9}".format(name, **p))
+    memory = result["memory_mb"]
+    if memory:
+        shown = np.unique(np.linspace(0, len(memory) - 1, 10).astype(int))
+        print("  worker memory, total / largest (MB): " + ", ".join(
+            "{0}s {1}/{2}".format(*memory[i]) for i in shown))
+
+
+def print_summary(results):
+    print("\n{0:<8} {1:>7} {2:>7} {3:>11} {4:>8} {5:>7} {6:>9} {7:>9} {8:>13}".format(
+        "class", "workers", "threads", "concurrency", "req/s", "errors", "p50 (ms)", "p99 (ms)", "peak RSS (MB)"))
+    for r in results:
+        print("{worker_class:<8} {workers:>7} {threads:>7} {concurrency:>11} {throughput:>8} {errors:>7} ".format(**r)
+              + "{0:>9} {1:>9} {2:>13}".format(r["latency_ms"]["p50"], r["latency_ms"]["p99"],
+                                               max((m[1] for m in r["memory_mb"]), default=0)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app:server", help="WSGI application for gunicorn")
+    parser.add_argument("--worker-class", nargs="+", default=["sync", "gthread"], choices=["sync", "gthread"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2])
+    parser.add_argument("--threads", type=int, default=4, help="threads per gthread worker")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[8], help="virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per configuration")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="mean pause in seconds between the requests of a user")
+    parser.add_argument("--data", help="csv to serve, a synthetic one is generated if not given")
+    parser.add_argument("--tweets", type=int, default=100000, help="size of the synthetic dataset")
+    parser.add_argument("--har", nargs="+", help="replay the sessions recorded in these HAR files")
+    parser.add_argument("--sessions", type=int, default=50, help="number of synthetic sessions")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory samples")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.TemporaryDirectory()
+    if args.data is None:
+        args.data = os.path.join(tmpdir.name, "tweets.csv")
+        print("Writing {0} synthetic tweets to {1}".format(args.tweets, args.data))
+        first, last = make_dataset(args.data, args.tweets, args.seed)
+    else:
+        dates = pd.to_datetime(pd.read_csv(args.data, usecols=["created_at"])["created_at"])
+        first, last = dates.min(), dates.max()
+
+    if args.har:
+        sessions = [load_har(path) for path in args.har]
+    else:
+        rng = random.Random(args.seed)
+        try:
+            sessions = [synthesize_session(rng, first.floor("d"), last.floor("d"))
+                        for _ in range(args.sessions)]
+        except ValueError as e:
+            parser.error(str(e))
+
+    results = []
+    for worker_class in args.worker_class:
+        for workers in args.workers:
+            for concurrency in args.concurrency:
+                result = run_config(args, sessions, worker_class, workers, concurrency)
+                print_report(result)
+                results.append(result)
+    print_summary(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Figure builders for the Twilitter Dash App
+
+Traces are built directly from NumPy arrays and wrapped in go.Figure with
+validation disabled, on top of layouts prepared once at import. This avoids
+the per-call overhead of plotly express and figure_factory.
+
+@author: pablo.otero@ieo.es
+"""
+
+import copy
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+# Minimal template, the full plotly one adds several KB to every figure
+template = {"layout": {"paper_bgcolor": "#1f2630", "plot_bgcolor": "#1f2630"}}
+
+# Layout of the bar charts in the volume analysis tab
+BAR_LAYOUT = {
+    "template": template,
+    "hovermode": "closest",
+    "legend": {"orientation": "v"},
+    "autosize": True,
+    "showlegend": False,
+    "paper_bgcolor": "#1f2630",
+    "plot_bgcolor": "#1f2630",
+    "font": {"color": "#7FDBFF"},
+    "title": {"x": 0.05},
+    "xaxis": {
+        "automargin": True,
+        "tickfont": {"color": "#7FDBFF"},
+        "gridcolor": "#5b5b5b",
+        "zerolinecolor": "#5b5b5b",
+        "title": {"standoff": 15},
+    },
+    "yaxis": {
+        "automargin": True,
+        "tickfont": {"color": "#7FDBFF"},
+        "gridcolor": "#5b5b5b",
+        "zerolinecolor": "#5b5b5b",
+        "title": {"standoff": 15},
+    },
+    "margin": {"t": 75, "r": 50, "b": 100, "l": 50},
+}
+
+# Layout of the hexbin map of tweets
+MAP_LAYOUT = {
+    "template": template,
+    "mapbox": {"style": "carto-positron"},
+    "margin": {"b": 0, "t": 0, "l": 0, "r": 0},
+}
+
+# Layout of the word bigrams network
+NETWORK_LAYOUT = {
+    "template": template,
+    "title": {
+        "text": "<br>Top-100 word bigrams of the overall period.",
+        "font": {"size": 16, "color": "#d6a622"},
+    },
+    "height": 700,
+    "plot_bgcolor": "#1f2630",
+    "paper_bgcolor": "#1f2630",
+    "showlegend": False,
+    "hovermode": "closest",
+    "margin": {"b": 20, "l": 5, "r": 5, "t": 40},
+    "xaxis": {"showgrid": False, "zeroline": False, "showticklabels": False},
+    "yaxis": {"showgrid": False, "zeroline": False, "showticklabels": False},
+}
+
+
+def _figure(data, layout):
+    """
+    Wrap plain trace dicts in a go.Figure without validating them
+    """
+    return go.Figure(data=data, layout=layout, _validate=False)
+
+
+def _bar_layout(title, xlabel, ylabel):
+    """
+    Copy of BAR_LAYOUT with the given title and axis labels
+    """
+    layout = copy.deepcopy(BAR_LAYOUT)
+    layout["title"]["text"] = title
+    layout["xaxis"]["title"]["text"] = xlabel
+    layout["yaxis"]["title"]["text"] = ylabel
+    return layout
+
+
+def bar_chart(x, y, title, xlabel, ylabel):
+    """
+    Bar chart of y against the categories x
+    """
+    trace = {
+        "type": "bar",
+        "x": np.asarray(x),
+        "y": np.asarray(y),
+        "marker": {"color": "#7FDBFF"},
+        "hovertemplate": xlabel + "=%{x}<br>" + ylabel + "=%{y}<extra></extra>",
+    }
+    return _figure([trace], _bar_layout(title, xlabel, ylabel))
+
+
+def change_chart(x, change, title, xlabel, ylabel, customdata, hovertemplate):
+    """
+    Bar chart of signed changes, rises in green and falls in red
+    """
+    change = np.asarray(change)
+    trace = {
+        "type": "bar",
+        "x": np.asarray(x),
+        "y": change,
+        "customdata": np.asarray(customdata),
+        "marker": {"color": np.where(change >= 0, "rgba(171, 220, 49, 1)", "rgba(255, 50, 50, 1)")},
+        "hovertemplate": hovertemplate,
+    }
+    return _figure([trace], _bar_layout(title, xlabel, ylabel))
+
+
+def _project_latlon(lat, lon):
+    """
+    Project lat and lon to Web Mercator, where the hexagons are regular
+    """
+    return np.radians(lon), np.arctanh(np.sin(np.radians(lat)))
+
+
+def _unproject_latlon(x, y):
+    """
+    Inverse of _project_latlon
+    """
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2), np.degrees(x)
+
+
+def _zoom_level(lat_min, lat_max, lon_min, lon_max, size=450):
+    """
+    Mapbox zoom level that fits the bounds in a square map of the given size
+    """
+    def lat_rad(lat):
+        return np.clip(np.arctanh(np.sin(np.radians(lat))), -np.pi, np.pi) / 2
+
+    lat_fraction = (lat_rad(lat_max) - lat_rad(lat_min)) / np.pi
+    lon_diff = lon_max - lon_min
+    lon_fraction = (lon_diff + 360 if lon_diff < 0 else lon_diff) / 360
+    fraction = max(lat_fraction, lon_fraction, 1e-9)
+    return min(0.95 * np.log2(size / 512 / fraction), 18)
+
+
+def hexbin(lat, lon, nx_hexagon):
+    """
+    Count points per hexagon, with the same binning as
+    plotly.figure_factory.create_hexbin_mapbox
+
+    Returns the integer ids of the non-empty hexagons, their counts and
+    the lat/lon of their vertices (shape M x 7, closed rings).
+    """
+    x, y = _project_latlon(lat, lon)
+    xmin, xmax = x.min(), x.max()
+    ymin, ymax = y.min(), y.max()
+    padding = 1.0e-9 * (xmax - xmin)
+    xmin -= padding
+    xmax += padding
+
+    dx = (xmax - xmin) / nx_hexagon
+    if dx == 0:
+        dx = (ymax - ymin) / nx_hexagon or np.radians(1)
+    dy = dx * np.sqrt(3)
+    ny = int(np.ceil((ymax - ymin) / dy))
+    ymin -= (ymin + dy * ny - ymax) / 2
+
+    # Two interleaved rectangular lattices, each point goes to the nearest
+    # center of either of them
+    x = (x - xmin) / dx
+    y = (y - ymin) / dy
+    ix1 = np.round(x).astype(int)
+    iy1 = np.round(y).astype(int)
+    ix2 = np.floor(x).astype(int)
+    iy2 = np.floor(y).astype(int)
+    nx1, ny1 = nx_hexagon + 1, ny + 1
+    d1 = (x - ix1) ** 2 + 3.0 * (y - iy1) ** 2
+    d2 = (x - ix2 - 0.5) ** 2 + 3.0 * (y - iy2 - 0.5) ** 2
+    first = d1 < d2
+
+    inside = np.where(
+        first,
+        (ix1 >= 0) & (ix1 < nx1) & (iy1 >= 0) & (iy1 < ny1),
+        (ix2 >= 0) & (ix2 < nx_hexagon) & (iy2 >= 0) & (iy2 < ny),
+    )
+    ids = np.where(first, ix1 * ny1 + iy1, nx1 * ny1 + ix2 * ny + iy2)[inside]
+    counts = np.bincount(ids, minlength=nx1 * ny1 + nx_hexagon * ny)
+    ids = np.flatnonzero(counts)
+    counts = counts[ids]
+
+    second = ids >= nx1 * ny1
+    local = np.where(second, ids - nx1 * ny1, ids)
+    rows = np.where(second, ny, ny1)
+    cx = local // rows + 0.5 * second
+    cy = local % rows + 0.5 * second
+
+    hx = np.array([0, 0.5, 0.5, 0, -0.5, -0.5, 0])
+    hy = np.array([-2, -1, 1, 2, 1, -1, -2]) / 6.0
+    vx = (cx[:, None] + hx) * dx + xmin
+    vy = (cy[:, None] + hy) * dy + ymin
+    vlat, vlon = _unproject_latlon(vx, vy)
+    return ids, counts, vlat, vlon
+
+
+def hexbin_map(lat, lon, nx_hexagon=100):
+    """
+    Map of tweet counts aggregated in hexagons
+    """
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    layout = copy.deepcopy(MAP_LAYOUT)
+    if len(lat) == 0:
+        layout["mapbox"].update(center={"lat": 0, "lon": 0}, zoom=0)
+        return _figure([], layout)
+
+    ids, counts, vlat, vlon = hexbin(lat, lon, nx_hexagon)
+    rings = np.round(np.stack([vlon, vlat], axis=-1), 4).tolist()
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "id": i, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+            for i, ring in zip(ids.tolist(), rings)
+        ],
+    }
+
+    lat_min, lat_max, lon_min, lon_max = lat.min(), lat.max(), lon.min(), lon.max()
+    layout["mapbox"].update(
+        center={"lat": (lat_min + lat_max) / 2, "lon": (lon_min + lon_max) / 2},
+        zoom=_zoom_level(lat_min, lat_max, lon_min, lon_max),
+    )
+    trace = {
+        "type": "choroplethmapbox",
+        "geojson": geojson,
+        "locations": ids,
+        "z": counts,
+        "zmin": counts.min(),
+        "zmax": counts.max(),
+        "colorscale": "Viridis",
+        "colorbar": {"title": {"text": "Tweet Count"}},
+        "marker": {"opacity": 0.5},
+        "hovertemplate": "Tweet Count=%{z}<extra></extra>",
+    }
+    return _figure([trace], layout)
+
+
+def network_graph(nodes, edges, pos):
+    """
+    Network of words. nodes is a list of labels, edges an (E, 2) integer
+    array of node indices and pos an (N, 2) array of node coordinates.
+    """
+    nodes = list(nodes)
+    edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+    pos = np.asarray(pos, dtype=float).reshape(-1, 2)
+
+    # Segments (x0, x1, NaN) so all edges are drawn by a single trace
+    edge_xy = np.full((len(edges), 3, 2), np.nan)
+    edge_xy[:, 0] = pos[edges[:, 0]]
+    edge_xy[:, 1] = pos[edges[:, 1]]
+    edge_xy = edge_xy.reshape(-1, 2)
+
+    # Node degree, a self-loop counts twice as in networkx
+    degree = np.bincount(edges.ravel(), minlength=len(nodes))
+
+    edge_trace = {
+        "type": "scatter",
+        "x": edge_xy[:, 0],
+        "y": edge_xy[:, 1],
+        "mode": "lines",
+        "line": {"color": "#7FDBFF", "width": 1},
+        "hoverinfo": "none",
+        "showlegend": False,
+    }
+    node_trace = {
+        "type": "scatter",
+        "x": pos[:, 0],
+        "y": pos[:, 1],
+        "text": nodes,
+        "mode": "markers",
+        "hoverinfo": "text",
+        "showlegend": False,
+        "marker": {
+            "showscale": True,
+            "colorscale": "YlOrRd",
+            "reversescale": False,
+            "color": degree,
+            "size": 15,
+            "colorbar": {
+                "thickness": 15,
+                "title": {"text": "Node Connections", "side": "right"},
+                "xanchor": "left",
+                "bgcolor": "white",
+            },
+            "line": {"width": 2},
+        },
+    }
+    return _figure([edge_trace, node_trace], copy.deepcopy(NETWORK_LAYOUT))
@@ -0,0 +1,86 @@
+"""
+City and country normalization for the Twilitter Dash App
+
+The free-text locations from the user profiles are mapped once, at ingest,
+to canonical names through an alias file. Each tweet keeps an integer code
+into a dimension table of canonical names, so the top cities/countries
+views are a bincount over the codes.
+
+@author: pablo.otero@ieo.es
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _key(name):
+    """
+    Lookup key of a location name: case and surrounding blanks are ignored
+    """
+    return " ".join(str(name).split()).casefold()
+
+
+def load_aliases(path):
+    """
+    Read the alias file, a csv with columns kind (city or country), alias
+    and canonical. Returns {kind: {alias key: canonical name}}.
+    """
+    aliases = {"city": {}, "country": {}}
+    if not os.path.exists(path):
+        print("Location alias file {0} not found, locations are not merged".format(path), flush=True)
+        return aliases
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    for kind, alias, canonical in table[["kind", "alias", "canonical"]].itertuples(index=False):
+        aliases[kind][_key(alias)] = canonical.strip()
+    return aliases
+
+
+def encode(values, aliases):
+    """
+    Map raw location strings to canonical ids
+
+    Only the distinct strings go through the alias lookup. Values that
+    differ only in case or blanks share an id. Returns an int32 array of
+    codes (-1 where the location is missing) and the dimension table, a
+    DataFrame with the name of each id: the canonical name from the alias
+    file, or else the most frequent spelling.
+    """
+    codes, uniques = pd.factorize(values)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    spellings = [" ".join(str(name).split()) for name in uniques]
+    aliased = [_key(name) in aliases for name in spellings]
+    names = [aliases.get(_key(name), name) for name in spellings]
+    key_codes, _ = pd.factorize(pd.Series([_key(name) for name in names], dtype=object))
+
+    # One row per id, preferring alias file names, then frequent spellings
+    table = pd.DataFrame({"id": key_codes, "name": names, "aliased": aliased, "count": counts})
+    table = (table.sort_values(["aliased", "count"], ascending=False, kind="stable")
+             .drop_duplicates("id").sort_values("id").set_index("id")[["name"]])
+
+    # The extra -1 at the end maps missing values (code -1) to -1
+    lookup = np.append(key_codes, -1).astype(np.int32)
+    return lookup[codes], table
+
+
+def normalize_locations(df, aliases):
+    """
+    Add the city_id and country_id columns to df. Returns the dataframe
+    and the cities and countries dimension tables.
+    """
+    df = df.copy()
+    df["city_id"], cities = encode(df["city_from_profile"], aliases["city"])
+    df["country_id"], countries = encode(df["country_from_profile"], aliases["country"])
+    return df, cities, countries
+
+
+def top_locations(codes, table, n=20):
+    """
+    Names and tweet counts of the n most frequent locations
+    """
+    codes = np.asarray(codes)
+    counts = np.bincount(codes[codes >= 0], minlength=len(table))
+    order = np.argsort(-counts, kind="stable")[:n]
+    order = order[counts[order] > 0]
+    return table["name"].values[order], counts[order]